@@ -4,6 +4,7 @@ class Settings(BaseSettings):
     WEBHOOK_SECRET: str = ""  # Optional - app starts without it, but webhook will reject requests
     DATABASE_URL: str = "sqlite:////data/app.db" 
     LOG_LEVEL: str = "INFO"
+    WEBHOOK_STRICT_VALIDATION: bool = False  # Full Pydantic validation of webhook bodies (dev)
 
     class Config:
         env_file = ".env" 
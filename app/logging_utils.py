@@ -1,6 +1,10 @@
+import atexit
 import logging
-import json
-from datetime import datetime, timezone
+import queue
+import sys
+import orjson
+from logging.handlers import QueueHandler, QueueListener
+from app.time_utils import utc_iso_now
 
 class JSONFormatter(logging.Formatter):
     """
@@ -9,7 +13,7 @@ class JSONFormatter(logging.Formatter):
     def format(self, record):
         # Basic log data
         log_obj = {
-            "ts": datetime.now(timezone.utc).isoformat(),
+            "ts": utc_iso_now(),
             "level": record.levelname,
             "message": record.getMessage(),
             "logger": record.name,
@@ -21,23 +25,93 @@ class JSONFormatter(logging.Formatter):
         if record.exc_info:
             log_obj["exception"] = self.formatException(record.exc_info)
 
-        return json.dumps(log_obj)
+        # orjson serializes in C; default=str covers any non-JSON extra values
+        return orjson.dumps(log_obj, default=str).decode()
+
+# Max records held back while the log queue keeps refilling
+MAX_PENDING_RECORDS = 128
+
+class BatchingStreamHandler(logging.StreamHandler):
+    """
+    StreamHandler that collects finished lines and writes them with one
+    write() once the log queue is drained (or MAX_PENDING_RECORDS pile up).
+    Lines are never split across writes, so other output on the same fd
+    (uvicorn, tracebacks) can only land between whole JSON lines.
+    """
+    def __init__(self, stream, log_queue: queue.Queue):
+        super().__init__(stream)
+        self.log_queue = log_queue
+        self.pending = []
+
+    def emit(self, record):
+        try:
+            self.pending.append(self.format(record) + self.terminator)
+            if self.log_queue.empty() or len(self.pending) >= MAX_PENDING_RECORDS:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.pending:
+                data = "".join(self.pending)
+                self.pending.clear()
+                self.stream.write(data)
+            if self.stream and hasattr(self.stream, "flush"):
+                self.stream.flush()
+        finally:
+            self.release()
+
+# Background thread that owns the real stream handler
+_listener = None
+_stream_handler = None
+
+def _stop_listener():
+    global _listener, _stream_handler
+    if _listener is not None:
+        # stop() drains the queue but never flushes the handlers; the last
+        # records can still sit in the stream buffer, so flush explicitly.
+        _listener.stop()
+        _stream_handler.flush()
+        _listener = None
+        _stream_handler = None
 
 def setup_logging(level: str = "INFO"):
     """
     Configures the root logger to use our JSON Formatter.
+    Records are formatted on the calling thread and handed to a QueueListener,
+    so the write syscalls happen off the event loop thread.
     """
+    global _listener, _stream_handler
+    _stop_listener()
+
     # Get the root logger
     logger = logging.getLogger()
     logger.setLevel(level)
 
-    # Create a handler that writes to Console (Standard Output)
-    handler = logging.StreamHandler()
-    
-    # Attach our JSON Formatter to the handler
-    formatter = JSONFormatter()
-    handler.setFormatter(formatter)
+    # Requests only enqueue records; QueueHandler.prepare() runs our JSON
+    # Formatter so the listener just writes the finished line
+    log_queue = queue.Queue(-1)
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setFormatter(JSONFormatter())
+
+    # Create a handler that writes to the console (stderr, as before) without
+    # closing the real stream; each batch is flushed as one write
+    try:
+        stream = open(sys.stderr.fileno(), "w", buffering=8192, encoding="utf-8", closefd=False)
+    except (AttributeError, OSError, ValueError):
+        # stderr replaced by something without a file descriptor
+        stream = sys.stderr
+    _stream_handler = BatchingStreamHandler(stream, log_queue)
+    _stream_handler.setFormatter(logging.Formatter("%(message)s"))
+
+    _listener = QueueListener(log_queue, _stream_handler, respect_handler_level=True)
+    _listener.start()
 
     # Clear existing handlers (to avoid duplicate logs) and add ours
     logger.handlers = []
-    logger.addHandler(handler)
\ No newline at end of file
+    logger.addHandler(queue_handler)
+
+# Flush whatever is still queued when the process exits
+atexit.register(_stop_listener)
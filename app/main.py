@@ -1,23 +1,24 @@
 import time
+import asyncio
 import uuid
 import logging
-import aiosqlite
 from fastapi import FastAPI, Request, Response, HTTPException, Header
-from contextlib import asynccontextmanager
+from fastapi.responses import JSONResponse, ORJSONResponse
+from contextlib import asynccontextmanager, suppress
 import hmac
 import hashlib
-import json
-from datetime import datetime, timezone
+import orjson
 
 from app.config import settings
-from app.storage import init_db, insert_message
+from app.storage import connect_db, init_db, insert_message, writer_loop, WRITER_SHUTDOWN_TIMEOUT
 from app.logging_utils import setup_logging
-from app.models import WebhookPayload
+from app.time_utils import utc_iso_now
+from app.models import WebhookPayload, parse_webhook_payload
 from typing import Optional
 from fastapi import Query
 from app.models import MessageResponse, StatsResponse
 from app.storage import get_messages, get_stats
-from app.metrics import HTTP_REQUESTS_TOTAL, WEBHOOK_REQUESTS_TOTAL, REQUEST_LATENCY, get_metrics_output
+from app.metrics import REQUEST_LATENCY, http_requests_counter, webhook_requests_counter, get_metrics_output
 
 setup_logging(settings.LOG_LEVEL)
 logger = logging.getLogger("api")
@@ -25,89 +26,174 @@ logger = logging.getLogger("api")
 # Lifespan Events: The modern way to run startup/shutdown code in FastAPI
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await init_db()
-    logger.info("Database initialized", extra={"extra_data": {"event": "startup"}})
-    yield
+    # Long-lived connections: app.state.db is handed to the webhook writer
+    # (which may replace it), app.state.read_db serves every query (only sees
+    # committed rows)
+    app.state.db = app.state.read_db = app.state.writer_task = None
+    try:
+        app.state.db = await connect_db()
+        await init_db(app.state.db)
+        app.state.read_db = await connect_db(read_only=True)
+        logger.info("Database initialized", extra={"extra_data": {"event": "startup"}})
+
+        # Webhook inserts go through a queue so a single writer can batch commits
+        app.state.write_queue = asyncio.Queue()
+        app.state.writer_task = asyncio.create_task(writer_loop(app.state.db, app.state.write_queue))
+        yield
+        # Let queued writes finish before stopping the writer
+        try:
+            await asyncio.wait_for(app.state.write_queue.join(), timeout=WRITER_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error("Timed out waiting for queued webhook writes", extra={"extra_data": {"event": "shutdown"}})
+    finally:
+        # Runs on failed startups too, so only close what was actually opened
+        if app.state.writer_task is not None:
+            app.state.writer_task.cancel()
+            # A writer that already died was reported by /health/ready
+            with suppress(asyncio.CancelledError, Exception):
+                await app.state.writer_task
+        if app.state.read_db is not None:
+            await app.state.read_db.close()
+        if app.state.db is not None:
+            await app.state.db.close()
+
+# orjson serializes straight to bytes in C, skipping the stdlib json encoder.
+# Newer FastAPI deprecates ORJSONResponse because it already serializes
+# response models to bytes through Pydantic, so keep its default there.
+DEFAULT_RESPONSE_CLASS = (
+    JSONResponse if getattr(ORJSONResponse, "__deprecated__", None) else ORJSONResponse
+)
+app = FastAPI(title="Lyftr Webhook API", lifespan=lifespan, default_response_class=DEFAULT_RESPONSE_CLASS)
 
-app = FastAPI(title="Lyftr Webhook API", lifespan=lifespan)
+# Probe/scrape endpoints hit far more often than real traffic; they are
+# counted but skip request_id, timing and the structured log line
+QUIET_PATHS = frozenset({"/health/live", "/health/ready", "/metrics"})
 
 # Middleware wrapper
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
+class LoggingMiddleware:
     """
-    Intercepts every request to log structured data.
+    Pure ASGI middleware that logs structured data for every request.
+    Only `send` is wrapped (to capture the status code), so no extra task
+    or Request/Response objects are created per request.
     """
-    # A. Start Timer & Generate ID
-    start_time = time.time()
-    request_id = str(uuid.uuid4())
-    
-    # Store request_id in state so endpoints can use it if needed
-    request.state.request_id = request_id
-    status_code = 500
+    def __init__(self, app):
+        self.app = app
 
-    # B. Process the Request (Call the actual endpoint)
-    try:
-        response = await call_next(request)
-        status_code = response.status_code
-    except Exception as e:
-        # If the app crashes, we still want to log it
-        process_time = (time.time() - start_time) * 1000
-        logger.error(
-            "Request failed",
-            extra={
-                "extra_data": {
-                    "ts": datetime.now(timezone.utc).isoformat(), # Redundant but safe
-                    "level": "ERROR",
-                    "request_id": request_id,
-                    "method": request.method,
-                    "path": request.url.path,
-                    "status": 500,
-                    "latency_ms": round(process_time, 2),
-                    "error": str(e)
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        if path in QUIET_PATHS:
+            await self._call_quiet(scope, receive, send, path)
+            return
+
+        # A. Start Timer & Generate ID
+        start_time = time.perf_counter_ns()
+        request_id = str(uuid.uuid4())
+
+        # Store request_id in state so endpoints can use it if needed
+        # (request.state is backed by this same dict)
+        state = scope.setdefault("state", {})
+        state["request_id"] = request_id
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        method = scope["method"]
+
+        # B. Process the Request (Call the actual endpoint)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            # If the app crashes, we still want to log it
+            process_time = (time.perf_counter_ns() - start_time) / 1_000_000
+            status_code = 500
+            logger.error(
+                "Request failed",
+                extra={
+                    "extra_data": {
+                        "ts": utc_iso_now(), # Redundant but safe
+                        "level": "ERROR",
+                        "request_id": request_id,
+                        "method": method,
+                        "path": path,
+                        "status": 500,
+                        "latency_ms": round(process_time, 2),
+                        "error": str(e)
+                    }
                 }
-            }
-        )
-        raise e
-    finally:
-        # --- METRICS LOGIC ---
-        process_time = (time.time() - start_time) * 1000
-        
-        # 1. Record Latency
-        REQUEST_LATENCY.observe(process_time)
-        
-        # 2. Record HTTP Count
-        # We group all /messages?q=... into just "/messages" to avoid infinite labels
-        path = request.url.path
-        HTTP_REQUESTS_TOTAL.labels(path=path, status=str(status_code)).inc()
+            )
+            raise e
+        finally:
+            # --- METRICS LOGIC ---
+            process_time = (time.perf_counter_ns() - start_time) / 1_000_000
 
-        # 3. Record Webhook Specifics
-        # If the endpoint set a 'result' in state, record it
-        if hasattr(request.state, "result"):
-            WEBHOOK_REQUESTS_TOTAL.labels(result=request.state.result).inc()
+            # 1. Record Latency
+            REQUEST_LATENCY.observe(process_time)
 
+            # 2. Record HTTP Count
+            http_requests_counter(path, status_code).inc()
 
-    if status_code < 500:
+            # 3. Record Webhook Specifics
+            # If the endpoint set a 'result' in state, record it
+            if "result" in state:
+                webhook_requests_counter(state["result"]).inc()
+
+        if status_code < 500:
             extra_fields = {
                 "request_id": request_id,
-                "method": request.method,
-                "path": request.url.path,
+                "method": method,
+                "path": path,
                 "status": status_code,
                 "latency_ms": round(process_time, 2),
             }
-            
-            if hasattr(request.state, "message_id"):
-                extra_fields["message_id"] = request.state.message_id
-            if hasattr(request.state, "dup"):
-                extra_fields["dup"] = request.state.dup
-            if hasattr(request.state, "result"):
-                extra_fields["result"] = request.state.result
+
+            if "message_id" in state:
+                extra_fields["message_id"] = state["message_id"]
+            if "dup" in state:
+                extra_fields["dup"] = state["dup"]
+            if "result" in state:
+                extra_fields["result"] = state["result"]
 
             logger.info(
-                "Request processed", 
+                "Request processed",
                 extra={"extra_data": extra_fields}
             )
-            
-    return response
+
+
+    async def _call_quiet(self, scope, receive, send, path):
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_counter(path, status_code).inc()
+
+
+app.add_middleware(LoggingMiddleware)
+
+
+# The secret is fixed for the process lifetime: encode it once (None = not configured)
+_SECRET_BYTES = settings.WEBHOOK_SECRET.encode("utf-8") if settings.WEBHOOK_SECRET else None
+
+# Key the HMAC once. The template holds the SHA-256 states already fed with
+# key^ipad / key^opad; copying it per request skips re-hashing the padded key blocks.
+_HMAC_TEMPLATE = (
+    hmac.new(_SECRET_BYTES, digestmod=hashlib.sha256)
+    if _SECRET_BYTES is not None else None
+)
 
 
 async def verify_signature(request: Request, body_bytes: bytes):
@@ -116,7 +202,7 @@ async def verify_signature(request: Request, body_bytes: bytes):
     Raises 401 if invalid or if no secret is configured.
     """
     # If no secret is configured, reject all requests
-    if not settings.WEBHOOK_SECRET:
+    if _SECRET_BYTES is None:
         raise HTTPException(status_code=401, detail="Webhook secret not configured")
     
     # Get the header
@@ -124,16 +210,18 @@ async def verify_signature(request: Request, body_bytes: bytes):
     if not x_signature:
         raise HTTPException(status_code=401, detail="Invalid signature")
     
-    # Calculate expected signature
-    secret_bytes = settings.WEBHOOK_SECRET.encode("utf-8")
-    expected_signature = hmac.new(
-        secret_bytes,
-        body_bytes,
-        hashlib.sha256
-    ).hexdigest()
+    # Decode the hex header to raw bytes (also makes the check case-insensitive)
+    try:
+        signature_bytes = bytes.fromhex(x_signature)
+    except ValueError:
+        raise HTTPException(status_code=401, detail="Invalid signature")
     
-    # Compare signatures
-    if not hmac.compare_digest(x_signature, expected_signature):
+    # Calculate expected signature from the pre-keyed HMAC state
+    mac = _HMAC_TEMPLATE.copy()
+    mac.update(body_bytes)
+    
+    # Compare the 32-byte digests in constant time
+    if not hmac.compare_digest(signature_bytes, mac.digest()):
         raise HTTPException(status_code=401, detail="Invalid signature")
     
     
@@ -146,15 +234,15 @@ async def liveness_probe():
     return {"status": "alive"}
 
 @app.get("/health/ready")
-async def readiness_probe():
+async def readiness_probe(request: Request):
     """
-    Checks if DB is reachable.
+    Checks if DB is reachable and the webhook writer is running.
     """
+    if request.app.state.writer_task.done():
+        raise HTTPException(status_code=503, detail="Webhook writer stopped")
     try:
-        # Try to run a simple query
-        from app.storage import get_db_path
-        async with aiosqlite.connect(get_db_path()) as db:
-            await db.execute("SELECT 1")
+        # Try to run a simple query on the read connection
+        await request.app.state.read_db.execute("SELECT 1")
         return {"status": "ready"}
     except Exception:
         # If DB fails, return 503 Service Unavailable
@@ -173,6 +261,9 @@ async def root():
         "config_check": f"Secret is configured: {bool(settings.WEBHOOK_SECRET)}"
     }
 
+# Successful webhook body never changes, so serialize it once
+_OK_RESPONSE_BODY = b'{"status":"ok"}'
+
 # Webhook Endpoint
 @app.post('/webhook')
 async def receive_webhook(request: Request):
@@ -195,17 +286,10 @@ async def receive_webhook(request: Request):
             request.state.result = "validation_error"
             raise HTTPException(status_code=422, detail="Empty request body")
         
-        # Decode bytes to string (handle non-UTF8)
+        # Parse JSON (orjson reads bytes directly and rejects non-UTF8 input)
         try:
-            body_str = body_bytes.decode("utf-8")
-        except UnicodeDecodeError:
-            request.state.result = "validation_error"
-            raise HTTPException(status_code=422, detail="Invalid UTF-8 encoding")
-        
-        # Parse JSON
-        try:
-            json_data = json.loads(body_str)
-        except json.JSONDecodeError as e:
+            json_data = orjson.loads(body_bytes)
+        except orjson.JSONDecodeError as e:
             request.state.result = "validation_error"
             raise HTTPException(status_code=422, detail=f"Invalid JSON: {str(e)}")
         
@@ -214,8 +298,12 @@ async def receive_webhook(request: Request):
             request.state.result = "validation_error"
             raise HTTPException(status_code=422, detail="Request body must be a JSON object")
         
-        # Validate with Pydantic
-        payload = WebhookPayload(**json_data)
+        # Validate: full Pydantic in strict mode, otherwise the same rules
+        # checked by hand and the model built without a validation pass
+        if settings.WEBHOOK_STRICT_VALIDATION:
+            payload = WebhookPayload(**json_data)
+        else:
+            payload = parse_webhook_payload(json_data)
     except HTTPException:
         raise
     except Exception as e:
@@ -226,16 +314,17 @@ async def receive_webhook(request: Request):
     request.state.message_id = payload.message_id
 
     # Database operation
-    status = await insert_message(payload)
+    status = await insert_message(request.app.state.write_queue, payload)
 
     # update logging context
     request.state.result = status
     request.state.dup = (status == "duplicate")
 
-    return {"status": "ok"}
+    return Response(content=_OK_RESPONSE_BODY, media_type="application/json")
 
 @app.get("/messages")
 async def list_messages(
+    request: Request,
     limit: int = Query(50, ge=1, le=100), # Default 50, Min 1, Max 100
     offset: int = Query(0, ge=0),         # Default 0, Min 0
     from_msisdn: Optional[str] = Query(None, alias="from"), # Map ?from= to from_msisdn
@@ -246,6 +335,7 @@ async def list_messages(
     Paginated list of messages with filters.
     """
     result = await get_messages(
+        request.app.state.read_db,
         limit=limit, 
         offset=offset, 
         from_msisdn=from_msisdn, 
@@ -255,17 +345,18 @@ async def list_messages(
     
     # We return the raw dict, but we could wrap it in a Pydantic model if we wanted strict validation here too.
     # For now, we return the shape { "data": [...], "total": N, "limit": N, "offset": N }
-    return {
+    # Returning the bytes directly bypasses jsonable_encoder on up to 100 rows.
+    return Response(content=orjson.dumps({
         "data": result["data"],
         "total": result["total"],
         "limit": limit,
         "offset": offset
-    }
+    }), media_type="application/json")
 
 @app.get("/stats", response_model=StatsResponse)
-async def get_analytics():
+async def get_analytics(request: Request):
     """
     Returns message statistics.
     """
-    stats = await get_stats()
+    stats = await get_stats(request.app.state.read_db)
     return stats
\ No newline at end of file
@@ -24,6 +24,30 @@ REQUEST_LATENCY = Histogram(
     buckets=[100, 500, float("inf")] # <100ms, <500ms, >500ms
 )
 
+# Bound child counters, cached so the hot path skips the labels() lookup
+# and the str(status) conversion. Paths and statuses form a small set.
+_HTTP_COUNTERS = {}
+_WEBHOOK_COUNTERS = {}
+
+def http_requests_counter(path: str, status: int):
+    """
+    Returns the http_requests_total child for (path, status).
+    """
+    key = (path, status)
+    counter = _HTTP_COUNTERS.get(key)
+    if counter is None:
+        counter = _HTTP_COUNTERS[key] = HTTP_REQUESTS_TOTAL.labels(path=path, status=str(status))
+    return counter
+
+def webhook_requests_counter(result: str):
+    """
+    Returns the webhook_requests_total child for a result.
+    """
+    counter = _WEBHOOK_COUNTERS.get(result)
+    if counter is None:
+        counter = _WEBHOOK_COUNTERS[result] = WEBHOOK_REQUESTS_TOTAL.labels(result=result)
+    return counter
+
 def get_metrics_output():
     """
     Returns the metrics in the format Prometheus expects.
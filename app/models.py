@@ -13,6 +13,39 @@ class WebhookPayload(BaseModel):
     class Config:
         populate_by_name = True
 
+def _required_str(data: dict, key: str, alias: Optional[str] = None) -> str:
+    value = data.get(alias, data.get(key)) if alias else data.get(key)
+    if value is None:
+        raise ValueError(f"Field required: {alias or key}")
+    if not isinstance(value, str):
+        raise ValueError(f"Input should be a valid string: {alias or key}")
+    return value
+
+def parse_webhook_payload(data: dict) -> WebhookPayload:
+    """
+    Applies the WebhookPayload field rules by hand and builds the model with
+    model_construct(), skipping the full Pydantic validation pass on the hot path.
+    Raises ValueError on invalid input.
+    """
+    message_id = _required_str(data, "message_id")
+    if not message_id:
+        raise ValueError("String should have at least 1 character: message_id")
+
+    text = data.get("text")
+    if text is not None:
+        if not isinstance(text, str):
+            raise ValueError("Input should be a valid string: text")
+        if len(text) > 4096:
+            raise ValueError("String should have at most 4096 characters: text")
+
+    return WebhookPayload.model_construct(
+        message_id=message_id,
+        from_msisdn=_required_str(data, "from_msisdn", alias="from"),
+        to_msisdn=_required_str(data, "to_msisdn", alias="to"),
+        ts=_required_str(data, "ts"),
+        text=text,
+    )
+
 # The output model that we send back to the user
 class MessageResponse(BaseModel):
     message_id: str
@@ -1,8 +1,10 @@
+import asyncio
 import aiosqlite
-from datetime import datetime, timezone
+from contextlib import suppress
 from typing import Optional, List, Dict, Any
 from app.config import settings
 from app.models import WebhookPayload
+from app.time_utils import utc_iso_now
 
 INIT_SCRIPT = """
 CREATE TABLE IF NOT EXISTS messages (
@@ -13,8 +15,48 @@ CREATE TABLE IF NOT EXISTS messages (
     text TEXT,
     created_at TEXT NOT NULL
 );
+-- Serves ORDER BY ts, message_id and the since filter on /messages
+CREATE INDEX IF NOT EXISTS idx_msgs_ts ON messages(ts, message_id);
+-- Serves the from filter on /messages and GROUP BY in /stats
+CREATE INDEX IF NOT EXISTS idx_msgs_from ON messages(from_msisdn);
 """
 
+# Trigram FTS5 index over messages.text, kept in sync by triggers.
+# Trigrams make `MATCH '"abc"'` a substring search, i.e. the same rows as
+# LIKE '%abc%' (for terms of 3+ characters) without scanning the table.
+# The index is keyed on the implicit rowid (message_id is a TEXT primary key),
+# which VACUUM may renumber: run
+#   INSERT INTO messages_fts(messages_fts) VALUES('rebuild')
+# after any VACUUM, or the index will point at the wrong rows.
+FTS_SCRIPT = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    text, content='messages', content_rowid='rowid', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, text) VALUES (new.rowid, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+    INSERT INTO messages_fts(rowid, text) VALUES (new.rowid, new.text);
+END;
+"""
+
+# Set by init_db; False when this SQLite build has no FTS5/trigram support
+FTS_ENABLED = False
+
+# journal_mode=WAL persists in the DB file; the others are per-connection,
+# so they are applied to both the writer and the read connection.
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",          # read connection doesn't block the writer's commits
+    "PRAGMA synchronous=NORMAL",        # one fsync per commit in WAL mode
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",       # 256 MB
+    "PRAGMA cache_size=-20000",         # ~20 MB page cache
+]
+
 def get_db_path():
     """
     Converts 'sqlite:////data/app.db' -> '/data/app.db'
@@ -24,121 +66,217 @@ def get_db_path():
         return url.replace("sqlite:///", "")
     return url
 
-async def init_db():
-    db_path = get_db_path()
-    async with aiosqlite.connect(db_path) as db:
-        await db.execute(INIT_SCRIPT)
-        await db.commit()
+async def connect_db(read_only: bool = False) -> aiosqlite.Connection:
+    """
+    Opens a long-lived connection, created once in the app lifespan instead
+    of once per request. The app keeps two: one owned by the writer task and a
+    read_only one for queries, so readers never see the writer's uncommitted
+    batch and don't queue behind it on the same aiosqlite thread.
+    """
+    db = await aiosqlite.connect(get_db_path())
+    db.row_factory = aiosqlite.Row
+    try:
+        for pragma in PRAGMAS:
+            await db.execute(pragma)
+        if read_only:
+            await db.execute("PRAGMA query_only=ON")
+    except BaseException:
+        # aiosqlite's worker thread is non-daemon: an unclosed connection
+        # would keep the process alive after a failed startup
+        await db.close()
+        raise
+    return db
 
-async def insert_message(payload: WebhookPayload) -> str:
-    now = datetime.now(timezone.utc).isoformat()
-    db_path = get_db_path() 
-    
-    async with aiosqlite.connect(db_path) as db:
-        cursor = await db.execute("SELECT message_id FROM messages WHERE message_id = ?", (payload.message_id,))
-        if await cursor.fetchone():
-            return "duplicate"
-
-        await db.execute(
-            "INSERT INTO messages (message_id, from_msisdn, to_msisdn, ts, text, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-            (payload.message_id, payload.from_msisdn, payload.to_msisdn, payload.ts, payload.text, now)
-        )
-        await db.commit()
-        return "created"
+async def init_db(db: aiosqlite.Connection):
+    global FTS_ENABLED
+    await db.executescript(INIT_SCRIPT)
+
+    cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")
+    fts_existed = await cursor.fetchone() is not None
+    try:
+        await db.executescript(FTS_SCRIPT)
+        if not fts_existed:
+            # Index messages stored before the FTS table was added
+            await db.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+        FTS_ENABLED = True
+    except aiosqlite.OperationalError:
+        # No FTS5 / trigram tokenizer (SQLite < 3.34): text search stays on LIKE
+        FTS_ENABLED = False
+    await db.commit()
+
+INSERT_SQL = """
+INSERT INTO messages (message_id, from_msisdn, to_msisdn, ts, text, created_at)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(message_id) DO NOTHING
+"""
+
+# Max number of queued webhooks committed together in one transaction
+WRITE_BATCH_SIZE = 128
+
+# Seconds shutdown waits for queued webhooks to be written
+WRITER_SHUTDOWN_TIMEOUT = 10
+
+async def insert_message(queue: asyncio.Queue, payload: WebhookPayload) -> str:
+    """
+    Hands the payload to the writer task and waits for its outcome
+    ("created" or "duplicate").
+    """
+    now = utc_iso_now()
+    future = asyncio.get_running_loop().create_future()
+    await queue.put((payload, now, future))
+    return await future
+
+async def writer_loop(db: aiosqlite.Connection, queue: asyncio.Queue):
+    """
+    Single writer task: waits for one queued webhook, drains whatever else is
+    already waiting (up to WRITE_BATCH_SIZE) and commits them all at once,
+    so the commit/fsync cost is shared by the whole batch.
+
+    The task owns `db` and closes it on exit. If a failed batch can't be
+    rolled back, the connection is replaced; if that fails too, the task
+    stops and the error surfaces through the readiness probe.
+    """
+    try:
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+
+            try:
+                results = []
+                for payload, now, _ in batch:
+                    # message_id is the PRIMARY KEY, so the conflict check happens in the
+                    # same B-tree lookup as the insert (no separate SELECT)
+                    cursor = await db.execute(
+                        INSERT_SQL,
+                        (payload.message_id, payload.from_msisdn, payload.to_msisdn, payload.ts, payload.text, now)
+                    )
+                    results.append("created" if cursor.rowcount == 1 else "duplicate")
+                await db.commit()
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                try:
+                    await db.rollback()
+                except Exception:
+                    # The failed inserts may still sit in the open transaction,
+                    # where the next batch's commit would store them. Closing the
+                    # connection discards them; later batches use a fresh one.
+                    with suppress(Exception):
+                        await db.close()
+                    db = await connect_db()
+            else:
+                for (_, _, future), result in zip(batch, results):
+                    # The request may have been cancelled while waiting
+                    if not future.done():
+                        future.set_result(result)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+    finally:
+        await db.close()
+
+# Response keys for /messages, in the same order as MESSAGE_SELECT_LIST
+MESSAGE_COLUMNS = ("message_id", "from", "to", "ts", "text", "created_at")
+MESSAGE_SELECT_LIST = "message_id, from_msisdn, to_msisdn, ts, text, created_at"
 
 async def get_messages(
+    db: aiosqlite.Connection,
     limit: int, 
     offset: int, 
     from_msisdn: Optional[str] = None, 
     since: Optional[str] = None, 
     q: Optional[str] = None
 ) -> Dict[str, Any]:
-    db_path = get_db_path() 
-    
-    async with aiosqlite.connect(db_path) as db:
-        db.row_factory = aiosqlite.Row
-
-        where_clauses = ["1=1"]
-        params = []
+    where_clauses = ["1=1"]
+    params = []
 
-        if from_msisdn:
-            where_clauses.append("from_msisdn = ?")
-            params.append(from_msisdn)
+    if from_msisdn:
+        where_clauses.append("from_msisdn = ?")
+        params.append(from_msisdn)
+    
+    if since:
+        where_clauses.append("ts >= ?")
+        params.append(since)
         
-        if since:
-            where_clauses.append("ts >= ?")
-            params.append(since)
-            
-        if q:
-            where_clauses.append("text LIKE ?")
-            params.append(f"%{q}%")
+    if q:
+        # Trigrams need 3+ characters, and % / _ are LIKE wildcards the FTS
+        # phrase would treat literally, so those queries stay on a plain LIKE
+        if FTS_ENABLED and len(q) >= 3 and "%" not in q and "_" not in q:
+            # FTS narrows the candidates, LIKE keeps the exact matching rules
+            where_clauses.append("rowid IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)")
+            params.append('"' + q.replace('"', '""') + '"')
+        where_clauses.append("text LIKE ?")
+        params.append(f"%{q}%")
+
+    where_str = " AND ".join(where_clauses)
 
-        where_str = " AND ".join(where_clauses)
+    # COUNT(*) OVER() is computed over the whole filtered set before LIMIT/OFFSET,
+    # so one query returns both the page and the total
+    data_query = f"""
+        SELECT {MESSAGE_SELECT_LIST}, COUNT(*) OVER() AS total FROM messages 
+        WHERE {where_str}
+        ORDER BY ts ASC, message_id ASC
+        LIMIT ? OFFSET ?
+    """
+    full_params = params + [limit, offset]
+    
+    async with db.cursor() as cursor:
+        # Plain tuples for this cursor: cheaper than aiosqlite.Row name lookups
+        cursor.row_factory = None
+        await cursor.execute(data_query, tuple(full_params))
+        rows = await cursor.fetchall()
 
+    if rows:
+        total_count = rows[0][len(MESSAGE_COLUMNS)]
+    elif offset == 0:
+        total_count = 0
+    else:
+        # Page is past the end, so there is no row to read the total from
         count_query = f"SELECT COUNT(*) FROM messages WHERE {where_str}"
         cursor = await db.execute(count_query, tuple(params))
         total_count = (await cursor.fetchone())[0]
 
-        data_query = f"""
-            SELECT * FROM messages 
-            WHERE {where_str}
-            ORDER BY ts ASC, message_id ASC
-            LIMIT ? OFFSET ?
-        """
-        full_params = params + [limit, offset]
-        
-        cursor = await db.execute(data_query, tuple(full_params))
-        rows = await cursor.fetchall()
+    # zip() stops at the last message column, leaving out the trailing total
+    data = [dict(zip(MESSAGE_COLUMNS, row)) for row in rows]
+
+    return {"data": data, "total": total_count}
+
+async def get_stats(db: aiosqlite.Connection) -> Dict[str, Any]:
+    query = """
+        SELECT 
+            COUNT(*) as total,
+            COUNT(DISTINCT from_msisdn) as senders,
+            MIN(ts) as first_ts,
+            MAX(ts) as last_ts
+        FROM messages
+    """
+    cursor = await db.execute(query)
+    stats = await cursor.fetchone()
 
-        data = []
-        for row in rows:
-            data.append({
-                "message_id": row["message_id"],
-                "from": row["from_msisdn"],
-                "to": row["to_msisdn"],
-                "ts": row["ts"],
-                "text": row["text"],
-                "created_at": row["created_at"]
-            })
-
-        return {"data": data, "total": total_count}
-
-async def get_stats() -> Dict[str, Any]:
-    db_path = get_db_path() # Use the helper here
+    sender_query = """
+        SELECT from_msisdn, COUNT(*) as count
+        FROM messages
+        GROUP BY from_msisdn
+        ORDER BY count DESC
+        LIMIT 10
+    """
+    cursor = await db.execute(sender_query)
+    sender_rows = await cursor.fetchall()
     
-    async with aiosqlite.connect(db_path) as db:
-        db.row_factory = aiosqlite.Row
-        
-        query = """
-            SELECT 
-                COUNT(*) as total,
-                COUNT(DISTINCT from_msisdn) as senders,
-                MIN(ts) as first_ts,
-                MAX(ts) as last_ts
-            FROM messages
-        """
-        cursor = await db.execute(query)
-        stats = await cursor.fetchone()
-
-        sender_query = """
-            SELECT from_msisdn, COUNT(*) as count
-            FROM messages
-            GROUP BY from_msisdn
-            ORDER BY count DESC
-            LIMIT 10
-        """
-        cursor = await db.execute(sender_query)
-        sender_rows = await cursor.fetchall()
-        
-        senders_list = [
-            {"from": row["from_msisdn"], "count": row["count"]} 
-            for row in sender_rows
-        ]
-
-        return {
-            "total_messages": stats["total"],
-            "senders_count": stats["senders"],
-            "messages_per_sender": senders_list,
-            "first_message_ts": stats["first_ts"],
-            "last_message_ts": stats["last_ts"]
-        }
\ No newline at end of file
+    senders_list = [
+        {"from": row["from_msisdn"], "count": row["count"]} 
+        for row in sender_rows
+    ]
+
+    return {
+        "total_messages": stats["total"],
+        "senders_count": stats["senders"],
+        "messages_per_sender": senders_list,
+        "first_message_ts": stats["first_ts"],
+        "last_message_ts": stats["last_ts"]
+    }
\ No newline at end of file
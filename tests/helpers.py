@@ -0,0 +1,43 @@
+"""
+Request helpers shared by the test modules.
+"""
+import functools
+import hmac
+import orjson
+from app.config import settings
+
+
+_SECRET = settings.WEBHOOK_SECRET.encode("utf-8")
+
+# Content-Type header for every webhook POST (merge in X-Signature per request)
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+@functools.lru_cache(maxsize=256)
+def _sig(body: bytes) -> str:
+    return hmac.digest(_SECRET, body, "sha256").hex()
+
+
+def compute_signature(body: bytes, secret: str = None) -> str:
+    """Compute HMAC-SHA256 signature for a request body."""
+    if secret is None:
+        return _sig(body)
+    return hmac.digest(secret.encode("utf-8"), body, "sha256").hex()
+
+
+async def insert_test_message(client, message_id: str, from_msisdn: str, ts: str, text: str = "Test"):
+    """Helper to insert a test message via webhook."""
+    payload = {
+        "message_id": message_id,
+        "from": from_msisdn,
+        "to": "+14155550100",
+        "ts": ts,
+        "text": text
+    }
+    body_bytes = orjson.dumps(payload)
+    signature = compute_signature(body_bytes)
+    await client.post(
+        "/webhook",
+        content=body_bytes,
+        headers={**JSON_HEADERS, "X-Signature": signature}
+    )
@@ -0,0 +1,58 @@
+"""
+Test suite for structured logging:
+- Batched lines are written with a single write()
+- _stop_listener flushes records still queued at shutdown
+"""
+import logging
+import queue
+import orjson
+from app import logging_utils
+from app.config import settings
+
+
+class _RecordingStream:
+    """Stream stub that keeps every write() call separately."""
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+    def flush(self):
+        pass
+
+
+def _record(message: str) -> logging.LogRecord:
+    return logging.LogRecord("test", logging.ERROR, __file__, 0, message, None, None)
+
+
+def test_batching_handler_writes_whole_batch_at_once():
+    """Test that lines are held while the queue refills and written together once it drains."""
+    stream = _RecordingStream()
+    log_queue = queue.Queue()
+    handler = logging_utils.BatchingStreamHandler(stream, log_queue)
+
+    log_queue.put_nowait(None)  # more records still waiting
+    handler.emit(_record("first"))
+    handler.emit(_record("second"))
+    assert stream.writes == []
+
+    log_queue.get_nowait()  # queue drained
+    handler.emit(_record("third"))
+    assert stream.writes == ["first\nsecond\nthird\n"]
+
+
+def test_stop_listener_flushes_queued_records(capfd):
+    """Test that records queued right before shutdown all reach stderr as JSON lines."""
+    logging_utils.setup_logging("INFO")
+    try:
+        logger = logging.getLogger("test.shutdown")
+        for i in range(50):
+            logger.error("queued %d", i, extra={"extra_data": {"i": i}})
+        logging_utils._stop_listener()
+
+        lines = capfd.readouterr().err.splitlines()
+        records = [orjson.loads(line) for line in lines if line.startswith("{")]
+        assert [r["i"] for r in records if r["logger"] == "test.shutdown"] == list(range(50))
+    finally:
+        logging_utils.setup_logging(settings.LOG_LEVEL)
@@ -5,167 +5,190 @@ Test suite for webhook endpoint:
 - Signature validation cases
 """
 import pytest
-import hmac
-import hashlib
-import json
-from httpx import AsyncClient, ASGITransport
-from app.main import app
-from app.config import settings
+import asyncio
+import sqlite3
+import time
+import orjson
+from tests.helpers import JSON_HEADERS, compute_signature
 
 
-def compute_signature(body: str, secret: str = None) -> str:
-    """Compute HMAC-SHA256 signature for a request body."""
-    if secret is None:
-        secret = settings.WEBHOOK_SECRET
-    return hmac.new(
-        secret.encode("utf-8"),
-        body.encode("utf-8"),
-        hashlib.sha256
-    ).hexdigest()
+_VALID_PAYLOAD = {
+    "message_id": "test-msg-001",
+    "from": "+919876543210",
+    "to": "+14155550100",
+    "ts": "2025-01-15T10:00:00Z",
+    "text": "Hello from test"
+}
+_VALID_BODY = orjson.dumps(_VALID_PAYLOAD)
 
 
 @pytest.fixture
 def valid_payload():
-    return {
-        "message_id": "test-msg-001",
-        "from": "+919876543210",
-        "to": "+14155550100",
-        "ts": "2025-01-15T10:00:00Z",
-        "text": "Hello from test"
-    }
+    # Function-scoped copy: several tests modify it before signing
+    return dict(_VALID_PAYLOAD)
+
+
+@pytest.fixture(scope="session")
+def signed_payload():
+    """(body_bytes, signature) for the unmodified valid payload, built once per session."""
+    return _VALID_BODY, compute_signature(_VALID_BODY)
 
 
 @pytest.mark.asyncio
-async def test_webhook_valid_insert(valid_payload):
+async def test_webhook_valid_insert(client, signed_payload):
     """Test that a valid webhook request inserts the message and returns 200."""
-    body = json.dumps(valid_payload)
-    signature = compute_signature(body)
-    
-    transport = ASGITransport(app=app)
-    async with AsyncClient(transport=transport, base_url="http://test") as client:
-        response = await client.post(
-            "/webhook",
-            content=body,
-            headers={
-                "Content-Type": "application/json",
-                "X-Signature": signature
-            }
-        )
+    body_bytes, signature = signed_payload
+    
+    response = await client.post(
+        "/webhook",
+        content=body_bytes,
+        headers={**JSON_HEADERS, "X-Signature": signature}
+    )
     
     assert response.status_code == 200
     assert response.json()["status"] == "ok"
 
 
 @pytest.mark.asyncio
-async def test_webhook_duplicate_returns_200(valid_payload):
+async def test_webhook_duplicate_returns_200(client, valid_payload):
     """Test that duplicate message_id returns 200 (idempotent)."""
     # Use unique message_id for this test
     valid_payload["message_id"] = "test-dup-001"
-    body = json.dumps(valid_payload)
-    signature = compute_signature(body)
-    
-    transport = ASGITransport(app=app)
-    async with AsyncClient(transport=transport, base_url="http://test") as client:
-        # First request - should create
-        response1 = await client.post(
-            "/webhook",
-            content=body,
-            headers={
-                "Content-Type": "application/json",
-                "X-Signature": signature
-            }
-        )
-        
-        # Second request with same message_id - should be duplicate
-        response2 = await client.post(
-            "/webhook",
-            content=body,
-            headers={
-                "Content-Type": "application/json",
-                "X-Signature": signature
-            }
-        )
+    body_bytes = orjson.dumps(valid_payload)
+    signature = compute_signature(body_bytes)
+    
+    # First request - should create
+    response1 = await client.post(
+        "/webhook",
+        content=body_bytes,
+        headers={**JSON_HEADERS, "X-Signature": signature}
+    )
+    
+    # Second request with same message_id - should be duplicate
+    response2 = await client.post(
+        "/webhook",
+        content=body_bytes,
+        headers={**JSON_HEADERS, "X-Signature": signature}
+    )
     
     assert response1.status_code == 200
     assert response2.status_code == 200  # Idempotent - still returns 200
 
 
+_ERROR_INVALID_JSON_BODY = b"not valid json"
+_ERROR_INCOMPLETE_BODY = orjson.dumps({
+    "message_id": "test-incomplete",
+    "from": "+919876543210"
+    # Missing: to, ts
+})
+
+
 @pytest.mark.asyncio
-async def test_webhook_invalid_signature_returns_401(valid_payload):
-    """Test that invalid signature returns 401."""
-    body = json.dumps(valid_payload)
-    invalid_signature = "invalid123"
-    
-    transport = ASGITransport(app=app)
-    async with AsyncClient(transport=transport, base_url="http://test") as client:
-        response = await client.post(
-            "/webhook",
-            content=body,
-            headers={
-                "Content-Type": "application/json",
-                "X-Signature": invalid_signature
-            }
-        )
+@pytest.mark.parametrize(
+    "headers,body_bytes,expected",
+    [
+        # Invalid signature
+        ({**JSON_HEADERS, "X-Signature": "invalid123"}, _VALID_BODY, 401),
+        # Missing X-Signature header
+        (JSON_HEADERS, _VALID_BODY, 401),
+        # Invalid JSON with a valid signature
+        (
+            {**JSON_HEADERS, "X-Signature": compute_signature(_ERROR_INVALID_JSON_BODY)},
+            _ERROR_INVALID_JSON_BODY,
+            422,
+        ),
+        # Missing required fields with a valid signature
+        (
+            {**JSON_HEADERS, "X-Signature": compute_signature(_ERROR_INCOMPLETE_BODY)},
+            _ERROR_INCOMPLETE_BODY,
+            422,
+        ),
+    ],
+    ids=["invalid_signature", "missing_signature", "invalid_json", "missing_required_field"],
+)
+async def test_webhook_errors(client, headers, body_bytes, expected):
+    """Test that bad signatures return 401 and malformed bodies return 422."""
+    response = await client.post("/webhook", content=body_bytes, headers=headers)
     
-    assert response.status_code == 401
+    assert response.status_code == expected
 
 
 @pytest.mark.asyncio
-async def test_webhook_missing_signature_returns_401(valid_payload):
-    """Test that missing X-Signature header returns 401."""
-    body = json.dumps(valid_payload)
-    
-    transport = ASGITransport(app=app)
-    async with AsyncClient(transport=transport, base_url="http://test") as client:
-        response = await client.post(
-            "/webhook",
-            content=body,
-            headers={"Content-Type": "application/json"}
-        )
+async def test_webhook_uppercase_signature_accepted(client, valid_payload):
+    """Test that the hex signature is compared case-insensitively."""
+    valid_payload["message_id"] = "test-upper-001"
+    body_bytes = orjson.dumps(valid_payload)
+    signature = compute_signature(body_bytes).upper()
     
-    assert response.status_code == 401
+    response = await client.post(
+        "/webhook",
+        content=body_bytes,
+        headers={**JSON_HEADERS, "X-Signature": signature}
+    )
+    
+    assert response.status_code == 200
 
 
 @pytest.mark.asyncio
-async def test_webhook_invalid_json_returns_422():
-    """Test that invalid JSON returns 422."""
-    body = "not valid json"
-    signature = compute_signature(body)
-    
-    transport = ASGITransport(app=app)
-    async with AsyncClient(transport=transport, base_url="http://test") as client:
-        response = await client.post(
-            "/webhook",
-            content=body,
-            headers={
-                "Content-Type": "application/json",
-                "X-Signature": signature
-            }
-        )
+async def test_webhook_text_too_long_returns_422(client, valid_payload):
+    """Test that text over 4096 characters returns 422."""
+    valid_payload["message_id"] = "test-long-text"
+    valid_payload["text"] = "x" * 4097
+    body_bytes = orjson.dumps(valid_payload)
+    signature = compute_signature(body_bytes)
+    
+    response = await client.post(
+        "/webhook",
+        content=body_bytes,
+        headers={**JSON_HEADERS, "X-Signature": signature}
+    )
     
     assert response.status_code == 422
 
 
 @pytest.mark.asyncio
-async def test_webhook_missing_required_field_returns_422():
-    """Test that missing required fields returns 422."""
-    incomplete_payload = {
-        "message_id": "test-incomplete",
-        "from": "+919876543210"
-        # Missing: to, ts
-    }
-    body = json.dumps(incomplete_payload)
-    signature = compute_signature(body)
-    
-    transport = ASGITransport(app=app)
-    async with AsyncClient(transport=transport, base_url="http://test") as client:
-        response = await client.post(
-            "/webhook",
-            content=body,
-            headers={
-                "Content-Type": "application/json",
-                "X-Signature": signature
-            }
+async def test_webhook_recovers_after_failed_commit(client, valid_payload, monkeypatch):
+    """Test that a failed batch commit fails only that request and the writer keeps running."""
+    from app.main import app
+    db = app.state.db
+    real_commit, real_rollback = db.commit, db.rollback
+    
+    async def failing_commit():
+        monkeypatch.setattr(db, "commit", real_commit)
+        raise sqlite3.OperationalError("disk I/O error")
+    
+    async def failing_rollback():
+        monkeypatch.setattr(db, "rollback", real_rollback)
+        raise sqlite3.OperationalError("disk I/O error")
+    
+    monkeypatch.setattr(db, "commit", failing_commit)
+    monkeypatch.setattr(db, "rollback", failing_rollback)
+    
+    # Unique ids, so rows left in test.db by earlier runs can't mask a phantom write
+    failed_id, ok_id = f"test-commit-fail-{time.time_ns()}", f"test-commit-ok-{time.time_ns()}"
+    valid_payload["message_id"] = failed_id
+    body_bytes = orjson.dumps(valid_payload)
+    with pytest.raises(sqlite3.OperationalError):
+        await asyncio.wait_for(
+            client.post("/webhook", content=body_bytes, headers={**JSON_HEADERS, "X-Signature": compute_signature(body_bytes)}),
+            timeout=2,
         )
     
-    assert response.status_code == 422
\ No newline at end of file
+    valid_payload["message_id"] = ok_id
+    body_bytes = orjson.dumps(valid_payload)
+    response = await asyncio.wait_for(
+        client.post("/webhook", content=body_bytes, headers={**JSON_HEADERS, "X-Signature": compute_signature(body_bytes)}),
+        timeout=2,
+    )
+    
+    assert response.status_code == 200
+    
+    # The failed request must not be committed by the next batch
+    cursor = await app.state.read_db.execute(
+        "SELECT message_id FROM messages WHERE message_id IN (?, ?)",
+        (failed_id, ok_id),
+    )
+    assert [row[0] for row in await cursor.fetchall()] == [ok_id]
+    
+    ready = await client.get("/health/ready")
+    assert ready.status_code == 200